@@ -1,8 +1,7 @@
 import os
 import gzip
-from xml.etree import cElementTree as ElementTree
-import pandas as pd
-from docx import Document  # from python-docx package
+import hashlib
+from xml.etree import ElementTree
 
 
 class XmlDictConfig(dict):
@@ -112,6 +111,64 @@ def parse_xml_file(fname):
     return xml_dict
 
 
+def read_hashes(file_name):
+    """
+    Read a sha1sum style file
+    :param file_name: name of the file
+    :return: dictionary {file name: sha1 hex digest}
+    """
+    hashes = dict()
+
+    if os.path.exists(file_name):
+        with open(file_name, 'r') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                elms = line.split('  ', 1)
+                # unparsable lines are ignored, those files get rewritten
+                if len(elms) == 2:
+                    hashes[elms[1]] = elms[0]
+
+    return hashes
+
+
+def write_atomic(file_name, data):
+    """
+    Write the bytes to a temporary file and move it over the target,
+    so that the target is never left half written
+    :param file_name: name of the file
+    :param data: bytes to write
+    """
+    tmp_name = file_name + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_name, file_name)
+
+
+def write_if_changed(folder, file_name, txt, new_hashes):
+    """
+    Write the text to the file only if its content hash differs from the file on disk
+    :param folder: base folder
+    :param file_name: name of the file relative to the folder
+    :param txt: text to write
+    :param new_hashes: dictionary {file name: sha1} of this run, updated here
+    :return: True if the file was written, False if it was already up to date
+    """
+    data = txt.encode('utf-8')
+    digest = hashlib.sha1(data).hexdigest()
+    new_hashes[file_name] = digest
+
+    path = os.path.join(folder, file_name)
+
+    if os.path.exists(path):
+        with open(path, 'rb') as f:
+            if hashlib.sha1(f.read()).hexdigest() == digest:
+                return False
+
+    write_atomic(path, data)
+
+    return True
+
+
 class DBAttribute:
 
     def __init__(self, lst):
@@ -400,8 +457,10 @@ class DBModel:
         self.relations = list()
         
         self.sql_code = ''
+
+        self.warnings = ''
         
-        if os.path.exists(fname):
+        if fname is not None and os.path.exists(fname):
             self.parse_file(fname)            
             self.output_file = os.path.basename(fname).replace('.dia', '.sql')
         else:
@@ -456,7 +515,9 @@ class DBModel:
             tbl_f.relationships.append(r)
 
             if len(tbl_f.pk) != len(attributes_to):
-                self.writer('/*INVALID RELATIONSHIIP:\n\t' + str(r) + '*/')
+                msg = '/*INVALID RELATIONSHIIP:\n\t' + str(r) + '*/'
+                self.warnings += msg
+                self.writer(msg)
 
         # find the table orders
         for tbl in self.tables:
@@ -488,6 +549,8 @@ class DBModel:
         Export the Model to a MS Word document
         :param: file_name: Name of the file
         """
+        from docx import Document  # from python-docx package
+
         document = Document()
 
         document.add_heading('Especificación ', 1)
@@ -554,6 +617,8 @@ class DBModel:
         if file_name is None:
             file_name = self.output_file.replace('.sql', '.xlsx')
 
+        import pandas as pd
+
         writer = pd.ExcelWriter(file_name)
 
         for tbl in self.tables:
@@ -571,12 +636,95 @@ class DBModel:
         text_file.write(self.sql_code)
         text_file.close()
 
+    def save_sharded(self, folder=None):
+        """
+        Save one SQL file per table in the tables sub-folder, plus:
+            - an include script named as the output file that runs the tables in
+              dependency order using psql \\ir commands (it requires psql)
+            - manifest.txt: plain list of the table files in dependency order
+            - sha1sums.txt: content hashes of the files produced by this run
+        Files whose content on disk is already up to date are not rewritten
+        Table files that are not produced by this run are deleted
+        :param folder: output folder, by default the output file name without extension
+        :return: list of the files written, list of the files deleted
+        """
+        # validate everything before touching the disk
+        if self.output_file.lower() in ['manifest.txt', 'sha1sums.txt', 'tables']:
+            raise ValueError('The output file name ' + self.output_file + ' is reserved')
+
+        # file names are compared in lower case for case-insensitive file systems
+        names = set()
+        for tbl in self.tables:
+            if tbl.name.lower() in names:
+                raise ValueError('Duplicated table name: ' + tbl.name)
+            names.add(tbl.name.lower())
+
+        if folder is None:
+            folder = os.path.splitext(self.output_file)[0]
+
+        tables_folder = os.path.join(folder, 'tables')
+        if not os.path.exists(tables_folder):
+            os.makedirs(tables_folder)
+
+        hashes_file = os.path.join(folder, 'sha1sums.txt')
+        old_hashes = read_hashes(hashes_file)
+        new_hashes = dict()
+
+        written = list()
+
+        # the include script carries the header and the relationship warnings
+        main = self.warnings
+        main += '\n' * 3
+        main += '/* DIA 2 SQL code generation */'
+        main += '\n' * 3
+
+        manifest = ''
+
+        # one file per table, the tables are already sorted by dependency order
+        for tbl in self.tables:
+            tbl_file = 'tables/' + tbl.name + '.sql'
+
+            if write_if_changed(folder, tbl_file, tbl.to_sql(), new_hashes):
+                written.append(tbl_file)
+
+            main += '\\ir ' + tbl_file + '\n'
+            manifest += tbl_file + '\n'
+
+        if write_if_changed(folder, self.output_file, main, new_hashes):
+            written.append(self.output_file)
+
+        if write_if_changed(folder, 'manifest.txt', manifest, new_hashes):
+            written.append('manifest.txt')
+
+        # remove the table files of the tables that no longer exist
+        deleted = list()
+        for f_name in sorted(os.listdir(tables_folder)):
+            tbl_file = 'tables/' + f_name
+            if f_name.endswith('.sql') and tbl_file not in new_hashes:
+                os.remove(os.path.join(folder, tbl_file))
+                deleted.append(tbl_file)
+
+        # remove the include script of a previous output file name
+        for f_name in old_hashes.keys():
+            path = os.path.join(folder, f_name)
+            if f_name not in new_hashes and os.path.basename(f_name) == f_name and os.path.exists(path):
+                os.remove(path)
+                deleted.append(f_name)
+
+        if old_hashes != new_hashes:
+            write_atomic(hashes_file, ''.join(digest + '  ' + f_name + '\n'
+                                              for f_name, digest in new_hashes.items()).encode('utf-8'))
+
+        return written, deleted
+
 
 def model_to_ms_word(model, file_name=None, table_style='Plain Table 1'):
     """
     Export the Model to a MS Word document for Trazar, else use the to_ms_word method of the model
     :param: file_name: Name of the file
     """
+    from docx import Document  # from python-docx package
+
     document = Document('plantilla_sql2dia.docx')
 
     # group tables by the comment
@@ -664,6 +812,7 @@ if __name__ == '__main__':
     model = DBModel(fname)
     print(model.to_sql())
     model.save()
+    # model.save_sharded()
 
     # model.to_ms_word()
     # model.to_excel()
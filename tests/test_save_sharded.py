@@ -0,0 +1,210 @@
+import os
+import gzip
+import re
+import pytest
+
+from dia2sql import DBModel
+
+
+DIA_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<dia:diagram xmlns:dia="http://www.lysator.liu.se/~alla/dia/">
+  <dia:layer name="Background" visible="true">
+    {objects}
+  </dia:layer>
+</dia:diagram>
+"""
+
+DIA_TABLE = """<dia:object type="Database - Table" version="0" id="{id}">
+  <dia:attribute name="name"><dia:string>#{name}#</dia:string></dia:attribute>
+  <dia:attribute name="comment"><dia:string>#{name} table#</dia:string></dia:attribute>
+  <dia:attribute name="attributes">
+    <dia:composite type="table_attribute">
+      <dia:attribute name="name"><dia:string>#id#</dia:string></dia:attribute>
+      <dia:attribute name="type"><dia:string>#int#</dia:string></dia:attribute>
+      <dia:attribute name="comment"><dia:string>##</dia:string></dia:attribute>
+      <dia:attribute name="primary_key"><dia:boolean val="true"/></dia:attribute>
+      <dia:attribute name="nullable"><dia:boolean val="false"/></dia:attribute>
+      <dia:attribute name="unique"><dia:boolean val="false"/></dia:attribute>
+    </dia:composite>
+    <dia:composite type="table_attribute">
+      <dia:attribute name="name"><dia:string>#value#</dia:string></dia:attribute>
+      <dia:attribute name="type"><dia:string>#float#</dia:string></dia:attribute>
+      <dia:attribute name="comment"><dia:string>##</dia:string></dia:attribute>
+      <dia:attribute name="primary_key"><dia:boolean val="false"/></dia:attribute>
+      <dia:attribute name="nullable"><dia:boolean val="false"/></dia:attribute>
+      <dia:attribute name="unique"><dia:boolean val="false"/></dia:attribute>
+    </dia:composite>
+  </dia:attribute>
+</dia:object>"""
+
+DIA_REFERENCE = """<dia:object type="Database - Reference" version="0" id="{id}">
+  <dia:attribute name="start_point_desc"><dia:string>#1#</dia:string></dia:attribute>
+  <dia:attribute name="end_point_desc"><dia:string>#n#</dia:string></dia:attribute>
+  <dia:connections>
+    <dia:connection handle="0" to="{id_from}" connection="12"/>
+    <dia:connection handle="1" to="{id_to}" connection="13"/>
+  </dia:connections>
+</dia:object>"""
+
+
+class FakeTable:
+
+    def __init__(self, name, sql=None):
+        self.name = name
+        self.sql = sql if sql is not None else 'CREATE TABLE ' + name + ' (id INTEGER);\n'
+
+    def to_sql(self):
+        return self.sql
+
+
+def make_model(*names):
+    model = DBModel()
+    model.output_file = 'schema.sql'
+    model.tables = [FakeTable(name) for name in names]
+    return model
+
+
+def write_dia_file(path):
+    """
+    Write a diagram where child references parent, which references grand_parent
+    The tables are listed in the reverse of the dependency order
+    """
+    objects = [DIA_TABLE.format(id='O0', name='child'),
+               DIA_TABLE.format(id='O1', name='parent'),
+               DIA_TABLE.format(id='O2', name='grand_parent'),
+               DIA_REFERENCE.format(id='O3', id_from='O0', id_to='O1'),
+               DIA_REFERENCE.format(id='O4', id_from='O1', id_to='O2')]
+
+    with gzip.open(str(path), 'wb') as f:
+        f.write(DIA_XML.format(objects='\n'.join(objects)).encode('utf-8'))
+
+
+def test_first_run_writes_everything(tmp_path):
+    model = make_model('a', 'b')
+    written, deleted = model.save_sharded(str(tmp_path))
+
+    assert written == ['tables/a.sql', 'tables/b.sql', 'schema.sql', 'manifest.txt']
+    assert deleted == []
+    assert (tmp_path / 'manifest.txt').read_text() == 'tables/a.sql\ntables/b.sql\n'
+    assert '\\ir tables/a.sql\n\\ir tables/b.sql\n' in (tmp_path / 'schema.sql').read_text()
+
+
+def test_second_run_writes_nothing(tmp_path):
+    model = make_model('a', 'b')
+    model.save_sharded(str(tmp_path))
+    mtime = os.path.getmtime(str(tmp_path / 'sha1sums.txt'))
+
+    assert model.save_sharded(str(tmp_path)) == ([], [])
+    assert os.path.getmtime(str(tmp_path / 'sha1sums.txt')) == mtime
+
+
+def test_changed_table_rewrites_only_its_file(tmp_path):
+    model = make_model('a', 'b')
+    model.save_sharded(str(tmp_path))
+
+    model.tables[1].sql = 'CREATE TABLE b (id INTEGER, x REAL);\n'
+
+    assert model.save_sharded(str(tmp_path)) == (['tables/b.sql'], [])
+    assert 'x REAL' in (tmp_path / 'tables' / 'b.sql').read_text()
+
+
+def test_renamed_table_deletes_old_file(tmp_path):
+    model = make_model('a', 'b')
+    model.save_sharded(str(tmp_path))
+
+    model.tables[1] = FakeTable('c')
+    written, deleted = model.save_sharded(str(tmp_path))
+
+    assert written == ['tables/c.sql', 'schema.sql', 'manifest.txt']
+    assert deleted == ['tables/b.sql']
+    assert sorted(os.listdir(str(tmp_path / 'tables'))) == ['a.sql', 'c.sql']
+
+
+def test_table_named_as_output_file(tmp_path):
+    model = make_model('code')
+    model.output_file = 'code.sql'
+    model.save_sharded(str(tmp_path))
+
+    assert model.save_sharded(str(tmp_path)) == ([], [])
+    assert (tmp_path / 'tables' / 'code.sql').read_text() == model.tables[0].sql
+
+
+def test_duplicated_table_name(tmp_path):
+    model = make_model('a', 'a')
+
+    with pytest.raises(ValueError):
+        model.save_sharded(str(tmp_path))
+
+
+def test_warnings_in_include_script(tmp_path):
+    model = make_model('a')
+    model.warnings = '/*INVALID RELATIONSHIIP:\n\ta_b*/'
+    model.save_sharded(str(tmp_path))
+
+    assert (tmp_path / 'schema.sql').read_text().startswith(model.warnings)
+
+
+def test_failed_run_is_reverted(tmp_path):
+    model = make_model('a')
+    model.save_sharded(str(tmp_path))
+    v1 = model.tables[0].sql
+
+    # the duplicated names are detected before anything is written
+    model.tables[0].sql = 'CREATE TABLE a (id INTEGER, x REAL);\n'
+    model.tables += [FakeTable('b'), FakeTable('B')]
+    with pytest.raises(ValueError):
+        model.save_sharded(str(tmp_path))
+
+    assert sorted(os.listdir(str(tmp_path / 'tables'))) == ['a.sql']
+    assert (tmp_path / 'tables' / 'a.sql').read_text() == v1
+
+    # a run that died after writing the table file but before the hashes
+    (tmp_path / 'tables' / 'a.sql').write_text(model.tables[0].sql)
+
+    model = make_model('a')
+    assert model.save_sharded(str(tmp_path)) == (['tables/a.sql'], [])
+    assert (tmp_path / 'tables' / 'a.sql').read_text() == v1
+
+
+def test_malformed_hashes_file(tmp_path):
+    model = make_model('a')
+    model.save_sharded(str(tmp_path))
+
+    (tmp_path / 'sha1sums.txt').write_text('garbage\n')
+
+    assert model.save_sharded(str(tmp_path)) == ([], [])
+
+
+def test_hand_edit_is_restored(tmp_path):
+    model = make_model('a', 'b')
+    model.save_sharded(str(tmp_path))
+
+    (tmp_path / 'tables' / 'a.sql').write_text('HAND EDIT')
+
+    assert model.save_sharded(str(tmp_path)) == (['tables/a.sql'], [])
+    assert (tmp_path / 'tables' / 'a.sql').read_text() == model.tables[0].sql
+
+
+def test_reserved_output_file(tmp_path):
+    model = make_model('a')
+    model.output_file = 'tables'
+
+    with pytest.raises(ValueError):
+        model.save_sharded(str(tmp_path / 'out'))
+
+    assert not os.path.exists(str(tmp_path / 'out'))
+
+
+def test_real_model_order(tmp_path):
+    fname = tmp_path / 'model.dia'
+    write_dia_file(fname)
+    model = DBModel(str(fname))
+
+    sql_order = re.findall(r'CREATE TABLE (\w+) \(', model.to_sql())
+    model.save_sharded(str(tmp_path / 'out'))
+    include = (tmp_path / 'out' / 'model.sql').read_text()
+
+    assert sorted(sql_order) == ['child', 'grand_parent', 'parent']
+    assert re.findall(r'\\ir tables/(\w+)\.sql', include) == sql_order
+    assert (tmp_path / 'out' / 'manifest.txt').read_text().split() == ['tables/' + n + '.sql' for n in sql_order]
+    assert 'REFERENCES parent(id)' in (tmp_path / 'out' / 'tables' / 'child.sql').read_text()